@@ -1,13 +1,12 @@
 #! /usr/bin/env python3
 
-from collections import OrderedDict
 import configparser
+import functools
 import os
 import sys
 
+from plaid2text import fast_config
 from plaid2text.interact import prompt, NullValidator, YesNoValidator
-from plaid import Client
-from plaid import errors as plaid_errors
 
 import json
 
@@ -22,6 +21,7 @@ class dotdict(dict):
     __delattr__ = dict.__delitem__
 
 
+@functools.lru_cache(maxsize=1)
 def get_locale_currency_symbol():
     """
     Get currency symbol from locale
@@ -31,6 +31,7 @@ def get_locale_currency_symbol():
     conv = locale.localeconv()
     return conv['int_curr_symbol']
 
+
 DEFAULT_CONFIG_DIR = os.path.expanduser('~/.config/plaid2text')
 
 CONFIG_DEFAULTS = dotdict({
@@ -41,7 +42,7 @@ CONFIG_DEFAULTS = dotdict({
     'output_format': 'beancount',
     'clear_screen': False,
     'cleared_character': '*',
-    'currency': get_locale_currency_symbol(),
+    'currency': None,  # Resolved lazily, see get_locale_currency_symbol()
     'default_expense': 'Expenses:Unknown',
     'encoding': 'utf-8',
     'output_date_format': '%Y/%m/%d',
@@ -83,18 +84,21 @@ def touch(fname, mode=0o666, dir_fd=None, **kwargs):
     """
     Implementation of coreutils touch
     http://stackoverflow.com/a/1160227
+
+    Times are only set when given via kwargs (times=/ns=); creating the
+    file already stamps it, so the extra utime call is skipped otherwise.
     """
     flags = os.O_CREAT | os.O_APPEND
     with os.fdopen(os.open(fname, flags=flags, mode=mode, dir_fd=dir_fd)) as f:
-        os.utime(f.fileno() if os.utime in os.supports_fd else fname,
-                 dir_fd=None if os.supports_fd else dir_fd, **kwargs)
+        if kwargs:
+            os.utime(f.fileno() if os.utime in os.supports_fd else fname,
+                     dir_fd=None if os.supports_fd else dir_fd, **kwargs)
 
 
 def get_custom_file_path(nickname, file_type, create_file=False):
     f = os.path.join(DEFAULT_CONFIG_DIR, nickname, file_type)
     if create_file:
-        if not os.path.exists(f):
-            _create_directory_tree(f)
+        _create_directory_tree(f)  # no-op when the directory exists
         touch(f)
         if file_type == 'template':
             with open(f, mode='w') as temp:
@@ -117,15 +121,61 @@ def config_exists():
         return True
 
 
+_CONFIG_CACHE = {'stat': None, 'defaults': None, 'sections': None, 'accounts': None}
+
+
 def _get_config_parser():
-    config = configparser.ConfigParser(CONFIG_DEFAULTS, interpolation=None)
+    parser_defaults = dict(CONFIG_DEFAULTS, currency=get_locale_currency_symbol())
+    config = configparser.ConfigParser(parser_defaults, interpolation=None)
     config.read(FILE_DEFAULTS.config_file)
     return config
 
 
+def _load_config():
+    """
+    Return (defaults, sections) parsed from the config file, re-reading it
+    only when the file's mtime or size has changed since the last parse.
+
+    defaults mirrors ConfigParser's DEFAULT section: CONFIG_DEFAULTS as
+    strings, overridden by any [DEFAULT] section in the file.
+    """
+    try:
+        st = os.stat(FILE_DEFAULTS.config_file)
+        stat_key = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        stat_key = None
+    if _CONFIG_CACHE['sections'] is not None and _CONFIG_CACHE['stat'] == stat_key:
+        return _CONFIG_CACHE['defaults'], _CONFIG_CACHE['sections']
+    sections = fast_config.load(FILE_DEFAULTS.config_file)
+    defaults = dict(
+        (k, str(v)) for k, v in CONFIG_DEFAULTS.items() if v is not None
+    )
+    defaults.update(sections.pop('DEFAULT', {}))
+    _CONFIG_CACHE['stat'] = stat_key
+    _CONFIG_CACHE['defaults'] = defaults
+    _CONFIG_CACHE['sections'] = sections
+    # Everything but the Plaid specific section is an account
+    _CONFIG_CACHE['accounts'] = [s for s in sections if s != 'PLAID']
+    return defaults, sections
+
+
+def _cached_sections():
+    """
+    The config file as a plain {section: {key: value}} dict
+    """
+    return _load_config()[1]
+
+
+def _invalidate_config_cache():
+    _CONFIG_CACHE['stat'] = None
+    _CONFIG_CACHE['defaults'] = None
+    _CONFIG_CACHE['sections'] = None
+    _CONFIG_CACHE['accounts'] = None
+
+
 def get_config(account):
-    config = _get_config_parser()
-    if not config.has_section(account):
+    config_defaults, sections = _load_config()
+    if account not in sections:
         print(
             'Config file {0} does not contain section for account: {1}\n\n'
             'To create this account: run plaid2text {1} --create-account'.format(
@@ -135,37 +185,43 @@ def get_config(account):
             file=sys.stderr
         )
         sys.exit(1)
-    defaults = OrderedDict(config.items(account))
+    defaults = dict(config_defaults)
+    defaults.update(sections[account])
+    if 'currency' not in defaults:
+        defaults['currency'] = get_locale_currency_symbol()
     defaults['plaid_account'] = account
     defaults['config_file'] = FILE_DEFAULTS.config_file
-    defaults['addons'] = OrderedDict()
+    defaults['addons'] = {}
+    home = os.path.expanduser('~')
     for f in ['template_file', 'mapping_file', 'headers_file', 'journal_file', 'accounts_file']:
-        if f in defaults:
-            defaults[f] = os.path.expanduser(defaults[f])
-    if config.has_section(account + '_addons'):
-        for item in config.items(account + '_addons'):
-            if item not in config.defaults().items():
+        if f not in defaults:
+            continue
+        path = defaults[f]
+        if path == '~' or path.startswith('~/'):
+            defaults[f] = home + path[1:]
+        elif path.startswith('~'):  # ~user form
+            defaults[f] = os.path.expanduser(path)
+    if account + '_addons' in sections:
+        addons = dict(config_defaults)
+        addons.update(sections[account + '_addons'])
+        defaults_set = set(config_defaults.items())
+        for item in addons.items():
+            if item not in defaults_set:
                 defaults['addons']['addon_' + item[0]] = int(item[1])
     return defaults
 
 
 def get_configured_accounts():
-    config = _get_config_parser()
-    accts = config.sections()
-    accts.remove('PLAID')  # Remove Plaid specific
-    return accts
+    _load_config()
+    return list(_CONFIG_CACHE['accounts'])
 
 
 def account_exists(account):
-    config = _get_config_parser()
-    if not config.has_section(account):
-        return False
-    return True
+    return account in _cached_sections()
 
 
 def get_plaid_config():
-    config = _get_config_parser()
-    plaid_section = config['PLAID']
+    plaid_section = _cached_sections()['PLAID']
     return plaid_section['client_id'], plaid_section['secret']
 
 
@@ -178,13 +234,14 @@ def write_section(section_dict):
     else:
         with open(FILE_DEFAULTS.config_file, mode='w') as f:
             config.write(f)
+        _invalidate_config_cache()
 
 
 def init_config():
     try:
         _create_directory_tree(FILE_DEFAULTS.config_file)
         config = configparser.ConfigParser(interpolation=None)
-        config['PLAID'] = OrderedDict()
+        config['PLAID'] = {}
         plaid = config['PLAID']
         client_id = prompt('Enter your Plaid client_id: ', validator=NullValidator())
         plaid['client_id'] = client_id
@@ -195,6 +252,7 @@ def init_config():
     else:
         with open(FILE_DEFAULTS.config_file, mode='w') as f:
             config.write(f)
+        _invalidate_config_cache()
     return True
 
 
@@ -212,17 +270,25 @@ def find_first_file(arg_file, alternatives):
     found = None
     file_locs = [arg_file] + [alternatives]
     for loc in file_locs:
-        if loc is not None and os.access(loc, os.F_OK | os.R_OK):
-            found = loc  # existing and readable
-            break
+        if loc is None:
+            continue
+        try:
+            os.stat(loc)
+        except OSError:  # missing or not reachable
+            continue
+        found = loc
+        break
     return found
 
 
 def create_account(account):
+    from plaid import Client
+    from plaid import errors as plaid_errors
+
     try:
         _create_directory_tree(FILE_DEFAULTS.config_file)
         config = configparser.ConfigParser(interpolation=None)
-        config[account] = OrderedDict()
+        config[account] = {}
         plaid = config[account]
         client_id, secret = get_plaid_config()
         # client_id = prompt('Enter your Plaid client_id: ', validator=NullValidator())
@@ -261,9 +327,10 @@ def create_account(account):
         accounts = response['accounts']
 
         print("\n\nAccounts:\n")
-        for item in accounts:
-            print(item['name'] + ":")
-            print(item['account_id'])
+        if accounts:
+            print('\n'.join(
+                '{}:\n{}'.format(item['name'], item['account_id']) for item in accounts
+            ))
         account_id = prompt('\nEnter account_id of desired account: ', validator=NullValidator())
         plaid['account'] = account_id
 
@@ -273,17 +340,18 @@ def create_account(account):
     else:
         with open(FILE_DEFAULTS.config_file, mode='a') as f:
             config.write(f)
+        _invalidate_config_cache()
     return True
 
-def generate_auth_page(link_token):
-    page = """<html>
+
+_AUTH_PAGE_TEMPLATE = """<html>
     <body>
     <button id='linkButton'>Open Link - Institution Select</button>
     <p id="results"></p>
     <script src="https://cdn.plaid.com/link/v2/stable/link-initialize.js"></script>
     <script>
     var linkHandler = Plaid.create({
-    token: '""" + link_token + """',
+    token: '%(link_token)s',
     onLoad: function() {
     // The Link module finished loading.
     },
@@ -314,9 +382,10 @@ def generate_auth_page(link_token):
     </html>
     """
 
-    f = open(FILE_DEFAULTS.auth_file, mode='w')
-    f.write(page)
-    f.close()
+
+def generate_auth_page(link_token):
+    with open(FILE_DEFAULTS.auth_file, mode='w') as f:
+        f.write(_AUTH_PAGE_TEMPLATE % {'link_token': link_token})
 
 
 if __name__ == '__main__':
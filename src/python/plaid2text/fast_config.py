@@ -0,0 +1,52 @@
+#! /usr/bin/env python3
+
+"""
+Minimal read-only INI parser for the plaid2text config file.
+
+Only handles what configparser.ConfigParser(interpolation=None) is used for
+on the read paths: [sections], key = value / key: value pairs, full line
+comments and indented continuation lines. Keys are lowercased like
+configparser's default optionxform.
+"""
+
+import re
+
+
+SECTION_RE = re.compile(r'^\[([^\]]+)\]\s*$')
+KV_RE = re.compile(r'^([^=:\s][^=:]*)\s*[=:]\s*(.*)$')
+COMMENT_PREFIXES = ('#', ';')
+
+
+def load(path):
+    """
+    Parse the file at path into {section: {key: value}}.
+
+    A missing file yields an empty dict, matching ConfigParser.read().
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return {}
+
+    sections = {}
+    current = None
+    key = None
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or stripped.startswith(COMMENT_PREFIXES):
+            continue
+        if line[0].isspace() and current is not None and key is not None:
+            # Continuation of the previous value
+            current[key] = current[key] + '\n' + stripped
+            continue
+        mo = SECTION_RE.match(stripped)
+        if mo:
+            current = sections.setdefault(mo.group(1), {})
+            key = None
+            continue
+        mo = KV_RE.match(stripped)
+        if mo and current is not None:
+            key = mo.group(1).strip().lower()
+            current[key] = mo.group(2).strip()
+    return sections
@@ -1,14 +1,18 @@
 #! /usr/bin/env python3
 
+import bisect
+import re
+
 from prompt_toolkit import prompt  # NOQA: F401
 from prompt_toolkit.validation import ValidationError, Validator
 from prompt_toolkit.completion.filesystem import PathCompleter
 from prompt_toolkit.completion.base import Completer, Completion
-from six import string_types
 
 
 PATH_COMPLETER = PathCompleter(expanduser=True)
 
+_NON_DIGIT_RE = re.compile(r'\D')
+
 
 def separator_completer(words, sep=' '):
     return SeparatorCompleter(words, sep=sep)
@@ -23,9 +27,14 @@ class SeparatorCompleter(Completer):
     :param ignore_case: If True, case-insensitive completion.
     """
     def __init__(self, words, ignore_case=True, sep=" "):
-        self.words = list(words)
+        self.words = words if isinstance(words, list) else list(words)
         self.ignore_case = ignore_case
-        assert all(isinstance(w, string_types) for w in self.words)
+        # Sorted (match key, word) pairs so prefix matches form one
+        # contiguous block that can be found with bisect
+        self._index = sorted(
+            ((w.lower() if ignore_case else w), w) for w in self.words
+        )
+        self._keys = [k for k, _ in self._index]
 
     def get_completions(self, document, complete_event):
         # Get word/text before cursor.
@@ -37,48 +46,44 @@ class SeparatorCompleter(Completer):
         if text_len < 1:
             return
 
-        if self.ignore_case:
-            text_before_cursor = text_before_cursor.lower()
-
         add_hyphen = False
         if text_before_cursor[0] == '-':
             text_before_cursor = text_before_cursor[1:]
             add_hyphen = True
 
-        def word_matches(word):
-            """ True when the word before the cursor matches. """
-            if self.ignore_case:
-                word = word.lower()
-
-            return word.startswith(text_before_cursor)
-
-        word_parts = set()
-        for w in self.words:
-            if word_matches(w):
-                last_colon = text_before_cursor.rfind(':') + 1  # Pos of last colon in text
-                last_pos = last_colon if last_colon > 0 else 0
-                next_colon = w.find(':', last_pos)
-                next_pos = next_colon
+        last_colon = text_before_cursor.rfind(':') + 1  # Pos of last colon in text
+        last_pos = last_colon if last_colon > 0 else 0
+        seen = set()
+        word_parts = []
+        keys = self._keys
+        for i in range(bisect.bisect_left(keys, text_before_cursor), len(keys)):
+            if not keys[i].startswith(text_before_cursor):
+                break
+            w = self._index[i][1]
+            next_colon = w.find(':', last_pos)
+            next_pos = next_colon
+            if next_colon < 0:
+                next_pos = len(w) - 1
+            next_colon = w.find(':', text_len)
+            if text_len == next_colon:  # Next char is colon
+                next_colon = w.find(':', next_colon + 1)
                 if next_colon < 0:
-                    next_pos = len(w) - 1
-                next_colon = w.find(':', text_len)
-                if text_len == next_colon:  # Next char is colon
-                    next_colon = w.find(':', next_colon + 1)
-                    if next_colon < 0:
-                        next_colon = len(w)
-                    ret = (w[0:next_colon], w[text_len:next_colon])
-                elif next_colon < 0:  # Next char is not colon
-                    last_word = text_before_cursor[last_colon:]
-                    display_word = w[last_colon:]
-                    if last_word == display_word.lower():
-                        continue
-                    ret = (w, display_word)
-                else:
-                    ret = (w[0:next_pos], w[last_pos:next_pos])
-                word_parts.add(ret)
-
-        word_parts = sorted(list(word_parts), key=lambda x: x[1])
-        for c, d in list(word_parts):
+                    next_colon = len(w)
+                ret = (w[0:next_colon], w[text_len:next_colon])
+            elif next_colon < 0:  # Next char is not colon
+                last_word = text_before_cursor[last_colon:]
+                display_word = w[last_colon:]
+                if last_word == display_word.lower():
+                    continue
+                ret = (w, display_word)
+            else:
+                ret = (w[0:next_pos], w[last_pos:next_pos])
+            if ret not in seen:
+                seen.add(ret)
+                word_parts.append(ret)
+
+        word_parts.sort(key=lambda x: x[1])
+        for c, d in word_parts:
             comp = '-' + c if add_hyphen else c
             yield Completion(comp, -text_len, display=d)
 
@@ -122,10 +127,8 @@ class NumberValidator(NullValidator):
         if self.allow_quit and text.lower() == 'q':
             return
         if not text.isdigit():
-            i = 0
-            for i, c in enumerate(text):
-                if not c.isdigit():
-                    break
+            m = _NON_DIGIT_RE.search(text)
+            i = m.start() if m else 0
             raise ValidationError(message=self.message, cursor_position=i)
 
         if not bool(self.max_number):
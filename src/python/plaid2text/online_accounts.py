@@ -1,21 +1,51 @@
 #! /usr/bin/env python3
 
-from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import datetime
 import os
 import sys
 import textwrap
 
-from plaid import Client
-from plaid import errors as plaid_errors
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 import plaid2text.config_manager as cm
 from plaid2text.interact import prompt, clear_screen, NullValidator
 from plaid2text.interact import NumberValidator, NumLengthValidator, YesNoValidator, PATH_COMPLETER
 
 
+_SESSION = None
+
+
+def _get_session():
+    """
+    Shared requests session so Plaid calls reuse keep-alive connections
+    instead of paying a TCP/TLS handshake per request
+    """
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        _SESSION = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=10,
+            max_retries=Retry(total=3, backoff_factor=0.3)
+        )
+        _SESSION.mount('http://', adapter)
+        _SESSION.mount('https://', adapter)
+    return _SESSION
+
+
 class PlaidAccess():
     def __init__(self, client_id=None, secret=None):
+        from plaid import Client
+        from plaid.internal import requester as plaid_requester
+
         if client_id and secret:
             self.client_id = client_id
             self.secret = secret
@@ -23,44 +53,81 @@ class PlaidAccess():
             self.client_id, self.secret = cm.get_plaid_config()
 
         self.client = Client(self.client_id, self.secret, "development", suppress_warnings=True)
+        # plaid-python has no session hook; it calls requests.post() from
+        # plaid.internal.requester for every request, so point that at the
+        # pooled session.
+        plaid_requester.requests = _get_session()
+        if orjson is not None:
+            # plaid-python decodes every response with json.loads(); orjson
+            # is a faster drop-in and raises a json.JSONDecodeError subclass
+            plaid_requester.json = orjson
 
     def get_transactions(self,
                          access_token,
                          start_date,
                          end_date,
                          account_ids):
-        """Get transaction for a given account for the given dates"""
-
-        ret = []
-        total_transactions = None
-        page = 0
-        account_array = []
-        account_array.append(account_ids)
-        while True:
-            page += 1 
-            if total_transactions:
-                print("Fetching page %d, already fetched %d/%d transactions" % ( page, len(ret), total_transactions))
-            else:
-                print("Fetching page 1")
-
-            try:
-                response = self.client.Transactions.get(
-                                access_token,
-                                start_date.strftime("%Y-%m-%d"),
-                                end_date.strftime("%Y-%m-%d"),
-                                account_ids=account_array,
-                                offset=len(ret))
-            except plaid_errors.ItemError as ex:
-                print("Unable to update plaid account [%s] due to: " % account_ids, file=sys.stderr)
-                print("    %s" % ex, file=sys.stderr )
-                sys.exit(1)
+        """Get transaction for the given account(s) for the given dates
 
+        account_ids may be a single account_id or a list of them.
+        """
+        from plaid import errors as plaid_errors
+
+        if isinstance(account_ids, list):
+            account_array = account_ids
+        else:
+            account_array = [account_ids]
+        start = start_date.strftime("%Y-%m-%d")
+        end = end_date.strftime("%Y-%m-%d")
+
+        def fetch(offset):
+            return self.client.Transactions.get(
+                            access_token,
+                            start,
+                            end,
+                            account_ids=account_array,
+                            count=500,  # Largest page Plaid allows
+                            offset=offset)
+
+        print("Fetching page 1")
+        try:
+            response = fetch(0)
             total_transactions = response['total_transactions']
+            ret = list(response['transactions'])
+            page_size = len(ret)
 
-            ret.extend(response['transactions'])
+            # The first page tells us how many transactions there are and how
+            # many come back per page, so the remaining pages can be
+            # requested concurrently rather than one round-trip at a time.
+            offsets = range(page_size, total_transactions, page_size) if page_size else []
+            if offsets:
+                print("Fetching %d more pages, already fetched %d/%d transactions" % (
+                    len(offsets), len(ret), total_transactions))
+                pages = {}
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    futures = {executor.submit(fetch, offset): offset for offset in offsets}
+                    for future in as_completed(futures):
+                        pages[futures[future]] = future.result()['transactions']
+                for offset in offsets:
+                    ret.extend(pages[offset])
+        except plaid_errors.ItemError as ex:
+            print("Unable to update plaid account [%s] due to: " % account_ids, file=sys.stderr)
+            print("    %s" % ex, file=sys.stderr )
+            sys.exit(1)
 
-            if len(ret) >= total_transactions: break
+        print("Downloaded %d transactions for %s - %s" % ( len(ret), start, end))
 
-        print("Downloaded %d transactions for %s - %s" % ( len(ret), start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d")))
+        return ret
 
+    def get_transactions_batch(self,
+                               access_token,
+                               start_date,
+                               end_date,
+                               account_ids):
+        """Get transactions for several accounts of the same Plaid item with
+        one set of requests, returned as {account_id: [transactions]}
+        """
+        ret = dict((account_id, []) for account_id in account_ids)
+        for t in self.get_transactions(access_token, start_date, end_date, list(account_ids)):
+            ret.setdefault(t['account_id'], []).append(t)
         return ret
@@ -13,19 +13,20 @@ https://github.com/quentinsf/icsv2ledger
 import argparse
 from datetime import datetime
 from operator import attrgetter
-import re
 import sys
 
-from plaid2text.renderers import LedgerRenderer, BeancountRenderer
 import plaid2text.config_manager as cm
-import plaid2text.storage_manager as storage_manager
-from plaid2text.online_accounts import PlaidAccess
+
+
+_TRUTHY = frozenset(('true', 'yes', '1', 't'))
 
 
 class FileType(object):
     """Based on `argparse.FileType` from python3.4.2, but with additional
     support for the `newline` parameter to `open`.
     """
+    __slots__ = ('_mode', '_bufsize', '_encoding', '_errors', '_newline')
+
     def __init__(self,
                  mode='r',
                  bufsize=-1,
@@ -81,12 +82,24 @@ class SortingHelpFormatter(argparse.HelpFormatter):
         super(SortingHelpFormatter, self).add_arguments(actions)
 
 
+def _wants_help(argv):
+    return '-h' in argv or '--help' in argv
+
+
+def _parse_date(date):
+    """Parse a YYYY-MM-DD or YYYY/MM/DD date"""
+    y, m, d = map(int, date.replace('/', '-').split('-'))
+    return datetime(y, m, d)
+
+
 def _parse_args_and_config_file():
     """ Read options from config file and CLI args
     1. Reads hard coded cm.CONFIG_DEFAULTS
     2. Supersedes by values in config file
     3. Supersedes by values from CLI args
     """
+    FD = cm.FILE_DEFAULTS
+    CD = cm.CONFIG_DEFAULTS
 
     # Build preparser with only plaid account
     preparser = argparse.ArgumentParser(prog='Plaid2Text', add_help=False)
@@ -113,11 +126,16 @@ def _parse_args_and_config_file():
 
     # Parse args with preparser, and find config file
     args, remaining_argv = preparser.parse_known_args()
+    wants_help = _wants_help(remaining_argv)
 
-    if "--create-account" in remaining_argv:
+    if "--create-account" in remaining_argv and not wants_help:
         cm.create_account(args.plaid_account)
 
-    defaults = cm.get_config(args.plaid_account) if args.plaid_account else {}
+    # argparse exits while printing help, so don't bother reading the config
+    if args.plaid_account and not wants_help:
+        defaults = cm.get_config(args.plaid_account)
+    else:
+        defaults = {}
     # defaults = cm.CONFIG_DEFAULTS
 
     # Build parser for args on command line
@@ -131,29 +149,31 @@ def _parse_args_and_config_file():
         formatter_class=SortingHelpFormatter
     )
 
-    parser.set_defaults(**defaults)
     parser.add_argument(
         '--accounts-file',
         metavar='FILE',
+        default=FD.accounts_file,
         help=(
             'file which holds a list of account names (LEDGER ONLY)'
-            ' (default : {0})'.format(cm.FILE_DEFAULTS.accounts_file)
+            ' (default : %(default)s)'
         )
     )
     parser.add_argument(
         '--headers-file',
         metavar='FILE',
+        default=FD.headers_file,
         help=(
             'file which contains contents to be written to the top of the output file'
-            ' (default : {0})'.format(cm.FILE_DEFAULTS.headers_file)
+            ' (default : %(default)s)'
         )
     )
     parser.add_argument(
         '--create-account',
         action='store_true',
+        default=CD.create_account,
         help=(
             'create a new account'
-            ' (default : {0})'.format(cm.CONFIG_DEFAULTS.create_account)
+            ' (default : %(default)s)'
         )
     )
 
@@ -161,18 +181,20 @@ def _parse_args_and_config_file():
         '--output-format',
         '-o',
         choices=['beancount', 'ledger'],
+        default=CD.output_format,
         help=(
             'what format to use for the output file.'
-            ' (default format: {})'.format(cm.CONFIG_DEFAULTS.output_format)
+            ' (default format: %(default)s)'
         )
     )
     parser.add_argument(
         '--posting-account',
         '-a',
         metavar='STR',
+        default=CD.posting_account,
         help=(
             'posting account used as source'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.posting_account)
+            ' (default: %(default)s)'
         )
     )
 
@@ -180,19 +202,21 @@ def _parse_args_and_config_file():
         '--journal-file',
         '-j',
         metavar='FILE',
+        default=FD.journal_file,
         help=(
             'journal file where to read payees/accounts\n'
             'Tip: you can use includes to pull in your other journal files'
-            ' (default journal file: {0})'.format(cm.FILE_DEFAULTS.journal_file)
+            ' (default journal file: %(default)s)'
         )
     )
     parser.add_argument(
         '--quiet',
         '-q',
         action='store_true',
+        default=CD.quiet,
         help=(
             'do not prompt if account can be deduced from mappings'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.quiet)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
@@ -207,52 +231,58 @@ def _parse_args_and_config_file():
     parser.add_argument(
         '--dbtype',
         choices=['mongodb', 'sqlite'],
+        default=CD.dbtype,
         help=(
             'The type of database to use for storing transactions [mongodb | sqlite]'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.dbtype)
+            ' (default: %(default)s)'
         )
     )
 
     parser.add_argument(
         '--mongo-db',
         metavar='STR',
+        default=CD.mongo_db,
         help=(
             'The name of the Mongo database'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.mongo_db)
+            ' (default: %(default)s)'
         )
     )
 
     parser.add_argument(
         '--mongo-db-uri',
         metavar='STR',
+        default=CD.mongo_db_uri,
         help=(
             'The URI for your MongoDB in the MongoDB URI format'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.mongo_db_uri)
+            ' (default: %(default)s)'
         )
     )
 
     parser.add_argument(
         '--sqlite-db',
         metavar='STR',
+        default=CD.sqlite_db,
         help=(
             'The path to the SQLite database for storing transactions'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.sqlite_db)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
         '--default-expense',
         metavar='STR',
+        default=CD.default_expense,
         help=(
             'expense account used as default destination'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.default_expense)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
         '--cleared-character',
         choices='*!',
+        default=CD.cleared_character,
         help=(
             'character to clear a transaction'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.cleared_character)
+            ' (default: %(default)s)'
         )
     )
 
@@ -270,44 +300,46 @@ def _parse_args_and_config_file():
         metavar='STR',
         help=(
             'the currency of amounts'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.currency)
+            ' (default: currency of the current locale)'
         )
     )
 
     parser.add_argument(
         '--mapping-file',
         metavar='FILE',
+        default=FD.mapping_file,
         help=(
             'file which holds the mappings'
-            ' (default: {0})'
-            .format(cm.FILE_DEFAULTS.mapping_file)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
         '--template-file',
         metavar='FILE',
+        default=FD.template_file,
         help=(
             'file which holds the template'
-            ' (default: {0})'
-            .format(cm.FILE_DEFAULTS.template_file)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
         '--tags',
         '-t',
         action='store_true',
+        default=CD.tags,
         help=(
             'prompt for transaction tags'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.tags)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
         '--clear-screen',
         '-C',
         action='store_true',
+        default=CD.clear_screen,
         help=(
             'clear screen for every transaction'
-            ' (default: {0})'.format(cm.CONFIG_DEFAULTS.clear_screen)
+            ' (default: %(default)s)'
         )
     )
     parser.add_argument(
@@ -351,29 +383,15 @@ def _parse_args_and_config_file():
         )
     )
 
+    # Config file values supersede the built-in defaults given above
+    parser.set_defaults(**defaults)
+
     # TODO NEED TO FIX - USING PARENTS causes file to be opened twice
     args = parser.parse_args()
 
-    args.journal_file = cm.find_first_file(
-        args.journal_file,
-        cm.FILE_DEFAULTS.journal_file
-    )
-    args.mapping_file = cm.find_first_file(
-        args.mapping_file,
-        cm.FILE_DEFAULTS.mapping_file
-    )
-    args.accounts_file = cm.find_first_file(
-        args.accounts_file,
-        cm.FILE_DEFAULTS.accounts_file
-    )
-    args.template_file = cm.find_first_file(
-        args.template_file,
-        cm.FILE_DEFAULTS.template_file
-    )
-    args.headers_file = cm.find_first_file(
-        args.headers_file,
-        cm.FILE_DEFAULTS.headers_file
-    )
+    file_args = ('journal_file', 'mapping_file', 'accounts_file', 'template_file', 'headers_file')
+    for f in file_args:
+        setattr(args, f, cm.find_first_file(getattr(args, f), FD[f]))
     # Make sure we have a plaid account and we are not calling --help
     if not args.plaid_account and 'help' not in args:
         print('You must provide the Plaid account as the first argument',
@@ -381,52 +399,89 @@ def _parse_args_and_config_file():
         sys.exit(1)
 
     if args.from_date:
-        y, m, d = [int(i) for i in re.split(r'[/-]', args.from_date)]
-        args.from_date = datetime(y, m, d)
+        args.from_date = _parse_date(args.from_date)
 
     if args.to_date:
-        y, m, d = [int(i) for i in re.split(r'[/-]', args.to_date)]
-        args.to_date = datetime(y, m, d)
+        args.to_date = _parse_date(args.to_date)
 
     return args
 
 
-def main():
-    # Make sure we have config file
-    if not cm.config_exists():
-        return
-
-    options = _parse_args_and_config_file()
-    truthy = ['true', 'yes', '1', 't']
-    # Convert config values to Boolean if pulled from file
-    if not isinstance(options.quiet, bool):
-        options.quiet = options.quiet.lower() in truthy
-    if not isinstance(options.tags, bool):
-        options.tags = options.tags.lower() in truthy
-    if not isinstance(options.clear_screen, bool):
-        options.clear_screen = options.clear_screen.lower() in truthy
+def _get_storage_manager(options):
+    import plaid2text.storage_manager as storage_manager
 
     if options.dbtype == 'mongodb':
-        sm = storage_manager.MongoDBStorage(
+        return storage_manager.MongoDBStorage(
             options.mongo_db,
             options.mongo_db_uri,
             options.plaid_account,
             options.posting_account
         )
     else:
-        sm = storage_manager.SQLiteStorage(
+        return storage_manager.SQLiteStorage(
             options.sqlite_db,
             options.plaid_account,
-            options.posting_account
+            options.posting_account,
+            account_id=getattr(options, 'account', None)
         )
 
+
+def _get_item_accounts(options):
+    """Map account_id -> options for every other configured account using
+    the same Plaid access token. Only the account itself differs; database
+    settings come from the resolved options so command line choices apply.
+    """
+    accounts = {}
+    for nickname in cm.get_configured_accounts():
+        if nickname == options.plaid_account:
+            continue
+        config = cm.get_config(nickname)
+        if config.get('access_token') == options.access_token and 'account' in config:
+            account_options = argparse.Namespace(**vars(options))
+            account_options.plaid_account = nickname
+            account_options.posting_account = config['posting_account']
+            account_options.account = config['account']
+            accounts[config['account']] = account_options
+    return accounts
+
+
+def main():
+    # Make sure we have config file
+    if not _wants_help(sys.argv[1:]) and not cm.config_exists():
+        return
+
+    options = _parse_args_and_config_file()
+    # Convert config values to Boolean if pulled from file
+    for attr in ('quiet', 'tags', 'clear_screen'):
+        value = getattr(options, attr)
+        if not isinstance(value, bool):
+            setattr(options, attr, value.lower() in _TRUTHY)
+
+    sm = _get_storage_manager(options)
+
     if options.download_transactions:
         if 'to_date' not in options or 'from_date' not in options:
             print('When downloading, both start and end date are required', file=sys.stderr)
             sys.exit(1)
 
-        trans = PlaidAccess().get_transactions(options.access_token, start_date=options.from_date, end_date=options.to_date,account_ids=options.account)
-        sm.save_transactions(trans)
+        # Imported here so that --help does not pay for plaid
+        from plaid2text.online_accounts import PlaidAccess
+
+        # Every configured account of the same Plaid item shares the access
+        # token, so download them all with one set of requests.
+        item_accounts = _get_item_accounts(options)
+        trans_by_account = PlaidAccess().get_transactions_batch(
+            options.access_token,
+            start_date=options.from_date,
+            end_date=options.to_date,
+            account_ids=[options.account] + list(item_accounts)
+        )
+        for account_id, trans in trans_by_account.items():
+            account_options = item_accounts.get(account_id)
+            if account_options is None:
+                sm.save_transactions(trans)
+            else:
+                _get_storage_manager(account_options).save_transactions(trans)
         print('Transactions successfully downloaded and saved into %s' % options.dbtype, file=sys.stdout)
         sys.exit(0)
 
@@ -442,19 +497,35 @@ def main():
                                from_date=from_date,
                                only_new=only_new)
 
-    if options.output_format == 'beancount':
-        out = BeancountRenderer(trxs, options)
-    else:
-        out = LedgerRenderer(trxs, options)
-
+    # Buffer the per-transaction updates and write them to the db in bulk
     callback = None
+    pending_updates = []
     if options.no_mark_pulled:
-        callback = lambda dict: sm.update_transaction(dict, mark_pulled=False)
+        def callback(update):
+            pending_updates.append(update)
+            if len(pending_updates) >= 500:
+                sm.update_transactions_bulk(pending_updates, mark_pulled=False)
+                del pending_updates[:]
 
     try:
+        from plaid2text.renderers import LedgerRenderer, BeancountRenderer
+        if options.output_format == 'beancount':
+            out = BeancountRenderer(trxs, options)
+        else:
+            out = LedgerRenderer(trxs, options)
+
         update_dict = out.process_transactions(callback=callback)
     except (KeyboardInterrupt, EOFError):
         print("\nProcess interrupted by keyboard interrupt.");
+    finally:
+        # Persist whatever was processed, even when interrupted
+        if pending_updates:
+            sm.update_transactions_bulk(pending_updates, mark_pulled=False)
+        # The Mongo cursor is opened without an idle timeout, so the server
+        # only frees it when it is closed
+        close = getattr(trxs, 'close', None)
+        if close:
+            close()
 
 if __name__ == '__main__':
     main()
@@ -1,7 +1,9 @@
 #! /usr/bin/env python3
 
 from abc import ABCMeta, abstractmethod
+from collections import ChainMap
 import csv
+import functools
 import os
 import re
 import subprocess
@@ -11,53 +13,92 @@ import plaid2text.config_manager as cm
 from plaid2text.interact import separator_completer, prompt
 
 
+# Pattern features that change meaning once a mapping regex is wrapped in a
+# group of the combined alternation: numbered backreferences and
+# conditional group references point at the wrong groups, and inline global
+# flags such as (?x) apply to every alternative (only an error on 3.11+)
+_UNCOMBINABLE_RE = re.compile(r'\\[1-9]|\(\?\(|\(\?[aiLmsux]+\)')
+# 'account' directives in a ledger accounts file. Whitespace is limited to
+# spaces and tabs so a match can not run on into the next line.
+_ACCOUNT_RE = re.compile(r'^[ \t]*account[ \t]+([:A-Za-z0-9-_ ]+)$', re.M)
+
+
+def _load_template(options):
+    """
+    Return the entry template: the template file if given and not empty,
+    else the default template for the output format
+    """
+    if options.template_file:
+        with open(options.template_file, 'r', encoding='utf-8') as f:
+            template = f.read()
+        if template:
+            return template
+    if options.output_format == 'ledger':
+        return cm.DEFAULT_LEDGER_TEMPLATE
+    return cm.DEFAULT_BEANCOUNT_TEMPLATE
+
+
+@functools.lru_cache(maxsize=4)
+def _load_beancount(path):
+    """
+    Parse a beancount journal once per process. beancount is imported here
+    so ledger users never pay for loading it.
+    """
+    from beancount import loader
+    return loader.load_file(path)
+
+
+def _tag_separator(options):
+    return ' ' if options.output_format == 'beancount' else ' ; '
+
+
 class Entry:
     """
     This represents one entry (transaction) from Plaid.
     """
 
-    def __init__(self, transaction, options={}):
+    def __init__(self, transaction, options={}, template=None, tag_sep=None):
         """Parameters:
         transaction: a plaid transaction
 
         options: from CLI args and config file
+
+        template, tag_sep: the entry template and the text put before tags,
+        normally prepared once by the OutputRenderer (see _load_template)
         """
         self.options = options
+        self._template = template if template is not None else _load_template(options)
+        if tag_sep is None:
+            tag_sep = _tag_separator(options)
+        self._tag_sep = tag_sep
 
-        self.transaction = transaction
+        self.transaction = t = transaction
         # TODO: document this
         if 'addons' in options:
-            self.transaction['addons'] = dict(
+            t['addons'] = dict(
                 (k, fields[v - 1]) for k, v in options.addons.items()  # NOQA
             )
         else:
-            self.transaction['addons'] = {}
-
-        # The id for the transaction
-        self.transaction['transaction_id'] = self.transaction['transaction_id']
+            t['addons'] = {}
 
         # Get the date and convert it into a ledger/beancount formatted date.
-        d8 = self.transaction['date']
+        d8 = t['date']
         d8_format = options.output_date_format if options and 'output_date_format' in options else '%Y-%m-%d'
-        self.transaction['transaction_date'] = d8.date().strftime(d8_format)
+        t['transaction_date'] = d8.date().strftime(d8_format)
 
-        self.desc = self.transaction['name']
+        self.desc = t['name']
 
-        # amnt = self.transaction['amount']
-        self.transaction['currency'] = options.currency
-        # self.transaction['debit_amount'] = amnt
-        # self.transaction['debit_currency'] = currency
-        # self.transaction['credit_amount'] = ''
-        # self.transaction['credit_currency'] = ''
+        # amnt = t['amount']
+        t['currency'] = options.currency
+        # t['debit_amount'] = amnt
+        # t['debit_currency'] = currency
+        # t['credit_amount'] = ''
+        # t['credit_currency'] = ''
 
-        self.transaction['posting_account'] = options.posting_account
-        self.transaction['cleared_character'] = options.cleared_character
+        t['posting_account'] = options.posting_account
+        t['cleared_character'] = options.cleared_character
 
-        if options.template_file:
-            with open(options.template_file, 'r', encoding='utf-8') as f:
-                self.transaction['transaction_template'] = f.read()
-        else:
-            self.transaction['transaction_template'] = ''
+        t['transaction_template'] = self._template
 
     def query(self):
         """
@@ -75,27 +116,16 @@ class Entry:
         Return a formatted journal entry recording this Entry against
         the specified posting account
         """
-        if self.options.output_format == 'ledger':
-            def_template = cm.DEFAULT_LEDGER_TEMPLATE
-        else:
-            def_template = cm.DEFAULT_BEANCOUNT_TEMPLATE
-        if self.transaction['transaction_template']:
-            template = (self.transaction['transaction_template'])
-        else:
-            template = (def_template)
-        if self.options.output_format == 'beancount':
-            ret_tags = ' {}'.format(tags) if tags else ''
-        else:
-            ret_tags = ' ; {}'.format(tags) if tags else ''
+        ret_tags = self._tag_sep + tags if tags else ''
 
         format_data = {
             'associated_account': account,
             'payee': payee,
             'tags': ret_tags
         }
-        format_data.update(self.transaction['addons'])
-        format_data.update(self.transaction)
-        return template.format(**format_data)
+        # Transaction fields win over addons, which win over the above
+        t = self.transaction
+        return self._template.format_map(ChainMap(t, t['addons'], format_data))
 
 
 class OutputRenderer(metaclass=ABCMeta):
@@ -107,12 +137,22 @@ class OutputRenderer(metaclass=ABCMeta):
         self.possible_accounts = set([])
         self.possible_payees = set([])
         self.possible_tags = set([])
+        # prompt text -> (values, len(values), completer), see _get_completer
+        self._completers = {}
         self.mappings = []
+        # Indexes into self.mappings: last literal mapping per description,
+        # and every regex mapping (see _find_mapping)
+        self._literal_mappings = {}
+        self._regex_mappings = []
+        self._combined_regex = None
         self.map_file = options.mapping_file
         self.read_mapping_file()
         self.journal_file = options.journal_file
         self.journal_lines = []
         self.options = options
+        # Read the template once instead of once per transaction
+        self.template = _load_template(options)
+        self._tag_sep = _tag_separator(options)
         self.get_possible_accounts_and_payees()
         # Add payees/accounts/tags from mappings
         for m in self.mappings:
@@ -154,7 +194,58 @@ class OutputRenderer(metaclass=ABCMeta):
                                 .format(pattern, self.map_file, e),
                                 file=sys.stderr)
                             sys.exit(1)
-                    self.mappings.append((pattern, payee, account, tags))
+                    self._add_mapping((pattern, payee, account, tags))
+        self._compile_regex_mappings()
+
+    def _add_mapping(self, mapping):
+        index = len(self.mappings)
+        self.mappings.append(mapping)
+        if isinstance(mapping[0], str):
+            self._literal_mappings[mapping[0]] = index
+        else:
+            self._regex_mappings.append(index)
+
+    def _compile_regex_mappings(self):
+        """
+        Combine all regex mappings into one alternation so a description is
+        matched with a single call. Alternatives are ordered newest first,
+        so the first one that matches is the mapping that must win; each
+        is wrapped in a named group to recover its index.
+        """
+        if not self._regex_mappings:
+            return
+        sources = [self.mappings[i][0].pattern for i in self._regex_mappings]
+        if any(_UNCOMBINABLE_RE.search(src) for src in sources):
+            return
+        combined = '|'.join(
+            '(?P<m{0}>{1})'.format(i, self.mappings[i][0].pattern)
+            for i in reversed(self._regex_mappings)
+        )
+        try:
+            self._combined_regex = re.compile(combined, re.I)
+        except re.error:
+            # e.g. clashing group names; match them one by one instead
+            self._combined_regex = None
+
+    def _find_mapping(self, desc):
+        """
+        Return the last mapping matching desc, or None.
+        """
+        best = self._literal_mappings.get(desc, -1)
+        if self._combined_regex is not None:
+            mo = self._combined_regex.match(desc)
+            if mo:
+                best = max(best, int(mo.lastgroup[1:]))
+        else:
+            # Later mappings win, so scan newest first and stop at the first
+            # match, or once nothing newer than the literal match is left
+            for i in reversed(self._regex_mappings):
+                if i < best:
+                    break
+                if self.mappings[i][0].match(desc):
+                    best = i
+                    break
+        return self.mappings[best] if best >= 0 else None
 
     def append_mapping_file(self, desc, payee, account, tags):
         if self.map_file:
@@ -175,10 +266,12 @@ class OutputRenderer(metaclass=ABCMeta):
         """
         out = self._process_plaid_transactions(callback=callback)
 
+        # Build the output up front and hand it to the file in one write
+        text = '\n'.join(self.journal_lines) + '\n'
         if self.options.headers_file:
-            headers = ''.join(open(self.options.headers_file, mode='r').readlines())
-            print(headers, file=self.options.outfile)
-        print(*self.journal_lines, sep='\n', file=self.options.outfile)
+            with open(self.options.headers_file, mode='r') as f:
+                text = f.read() + '\n' + text
+        self.options.outfile.write(text)
         return out 
 
     def _process_plaid_transactions(self, callback=None):
@@ -187,7 +280,7 @@ class OutputRenderer(metaclass=ABCMeta):
         """
         out = []
         for t in self.transactions:
-            entry = Entry(t, self.options)
+            entry = Entry(t, self.options, self.template, self._tag_sep)
             payee, account, tags = self.get_payee_and_account(entry)
             dic = {}
             dic['transaction_id'] = t['transaction_id']
@@ -204,31 +297,37 @@ class OutputRenderer(metaclass=ABCMeta):
         return out
 
     def prompt_for_value(self, text_prompt, values, default):
-        sep = ':' if text_prompt == 'Payee' else ' '
         a = prompt(
             '{} [{}]: '.format(text_prompt, default),
-            completer=separator_completer(values, sep=sep)
+            completer=self._get_completer(text_prompt, values)
         )
         # Handle tag returning none if accepting
         return a if (a or text_prompt == 'Tag') else default
 
+    def _get_completer(self, text_prompt, values):
+        """
+        Return the completer for a prompt, reusing the last one built for it
+        unless values has changed. The possible_* sets are only ever added
+        to, so an unchanged size means unchanged contents.
+        """
+        cached = self._completers.get(text_prompt)
+        if cached and cached[0] is values and cached[1] == len(values):
+            return cached[2]
+        sep = ':' if text_prompt == 'Payee' else ' '
+        completer = separator_completer(values, sep=sep)
+        self._completers[text_prompt] = (values, len(values), completer)
+        return completer
+
     def get_payee_and_account(self, entry):
         payee = entry.desc
         account = self.options.default_expense
         tags = ''
         found = False
-        # Try to match entry desc with mappings patterns
-        for m in self.mappings:
-            pattern = m[0]
-            if isinstance(pattern, str):
-                if entry.desc == pattern:
-                    payee, account, tags = m[1], m[2], m[3]
-                    found = True  # do not break here, later mapping must win
-            else:
-                # If the pattern isn't a string it's a regex
-                if m[0].match(entry.desc):
-                    payee, account, tags = m[1], m[2], m[3]
-                    found = True
+        # Try to match entry desc with mappings patterns, later mapping wins
+        m = self._find_mapping(entry.desc)
+        if m:
+            payee, account, tags = m[1], m[2], m[3]
+            found = True
         # Tags gets read in as a list, but just contains one string
         if tags:
             tags = tags[0]
@@ -259,7 +358,7 @@ class OutputRenderer(metaclass=ABCMeta):
 
         if not found or (found and modified):
             # Add new or changed mapping to mappings and append to file
-            self.mappings.append((entry.desc, payee, account, tags))
+            self._add_mapping((entry.desc, payee, account, tags))
             self.append_mapping_file(entry.desc, payee, account, tags)
 
             # Add new possible_values to possible values lists
@@ -294,20 +393,23 @@ class LedgerRenderer(OutputRenderer):
         self.read_accounts_file()
 
     def prompt_for_tags(self, prompt, values, default):
-        # tags = list(default[0].split(':'))
-        tags = [':{}:'.format(t) for t in default.split(':') if t] if default else []
-        value = self.prompt_for_value(prompt, values, ''.join(tags).replace('::', ':'))
+        # A dict keeps the tags in order with O(1) membership and removal
+        tags = dict.fromkeys(':{}:'.format(t) for t in default.split(':') if t) if default else {}
+        joined = ''.join(tags).replace('::', ':')
+        value = self.prompt_for_value(prompt, values, joined)
         while value:
             if value[0] == '-':
                 value = self.tagify(value[1:])
                 if value in tags:
-                    tags.remove(value)
+                    del tags[value]
+                    joined = ''.join(tags).replace('::', ':')
             else:
                 value = self.tagify(value)
                 if value not in tags:
-                    tags.append(value)
-            value = self.prompt_for_value(prompt, values, ''.join(tags).replace('::', ':'))
-        return ''.join(tags).replace('::', ':')
+                    tags[value] = None
+                    joined = ''.join(tags).replace('::', ':')
+            value = self.prompt_for_value(prompt, values, joined)
+        return joined
 
     def _payees_from_ledger(self):
         return self._from_ledger('payees')
@@ -323,12 +425,11 @@ class LedgerRenderer(OutputRenderer):
                 break
 
         cmd = [ledger, '-f', self.journal_file, command]
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (stdout_data, stderr_data) = p.communicate()
-        items = set()
-        for item in stdout_data.decode('utf-8').splitlines():
-            items.add(item)
-        return items
+        # Build the set straight from the pipe instead of buffering all of
+        # stdout and splitting it into a list first
+        with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              encoding='utf-8') as p:
+            return {line.rstrip('\r\n') for line in p.stdout}
 
     def read_accounts_file(self):
         """ Process each line in the specified account file looking for account
@@ -342,20 +443,11 @@ class LedgerRenderer(OutputRenderer):
         """
         if not self.options.accounts_file:
             return
-        accounts = []
-        pattern = re.compile('^\s*account\s+([:A-Za-z0-9-_ ]+)$')
         with open(self.options.accounts_file, 'r', encoding='utf-8') as f:
-            for line in f.readlines():
-                mo = pattern.match(line)
-                if mo:
-                    accounts.append(mo.group(1))
-
-        self.possible_accounts.update(accounts)
+            self.possible_accounts.update(_ACCOUNT_RE.findall(f.read()))
 
 
 class BeancountRenderer(OutputRenderer):
-    import beancount
-
     def tagify(self, value):
         # No spaces or commas allowed
         return value.replace(' ', '-').replace(',', '')
@@ -366,50 +458,39 @@ class BeancountRenderer(OutputRenderer):
 
     def _payees_and_accounts_from_beancount(self):
         try:
-            payees = set()
-            accounts = set()
-            tags = set()
-            from beancount import loader
             from beancount.core.data import Transaction, Open
-            import sys
-            entries, errors, options = loader.load_file(self.journal_file)
+            entries, errors, options = _load_beancount(self.journal_file)
 
         except Exception as e:
-            print(e.message, file=sys.stderr)
+            print(e, file=sys.stderr)
             sys.exit(1)
         else:
-            for e in entries:
-                if type(e) is Transaction:
-                    if e.payee:
-                        payees.add(e.payee)
-                    if e.tags:
-                        for t in e.tags:
-                            tags.add(t)
-                    if e.postings:
-                        for p in e.postings:
-                            accounts.add(p.account)
-                elif type(e) is Open:
-                    accounts.add(e.account)
+            transactions = [e for e in entries if isinstance(e, Transaction)]
+            payees = {e.payee for e in transactions if e.payee}
+            tags = {t for e in transactions if e.tags for t in e.tags}
+            accounts = {p.account for e in transactions if e.postings for p in e.postings}
+            accounts.update(e.account for e in entries if isinstance(e, Open))
 
         self.possible_accounts.update(accounts)
         self.possible_tags.update(tags)
         self.possible_payees.update(payees)
 
     def prompt_for_tags(self, prompt, values, default):
-        tags = ' '.join(['#{}'.format(t) for t in default.split() if t]) if default else []
-        value = self.prompt_for_value(prompt, values, ' '.join(['#{}'.format(t) for t in tags]))
+        # default is the '#a #b' string this method returns; keep the bare
+        # tag names, in order, in a dict for O(1) membership and removal
+        tags = dict.fromkeys(t.lstrip('#') for t in default.split() if t) if default else {}
+        joined = ' '.join(['#{}'.format(t) for t in tags])
+        value = self.prompt_for_value(prompt, values, joined)
         while value:
             if value[0] == '-':
                 value = self.tagify(value[1:])
                 if value in tags:
-                    tags.remove(value)
+                    del tags[value]
+                    joined = ' '.join(['#{}'.format(t) for t in tags])
             else:
                 value = self.tagify(value)
                 if value not in tags:
-                    tags.append(value)
-            value = self.prompt_for_value(
-                prompt,
-                values,
-                ' '.join(['#{}'.format(t) for t in tags])
-            )
-        return ' '.join(['#{}'.format(t) for t in tags])
+                    tags[value] = None
+                    joined = ' '.join(['#{}'.format(t) for t in tags])
+            value = self.prompt_for_value(prompt, values, joined)
+        return joined
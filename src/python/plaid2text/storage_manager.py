@@ -1,26 +1,51 @@
 #! /usr/bin/env python3
 
 import datetime
-from dateutil import parser as date_parser
 import sqlite3
 import json
 
 from abc import ABCMeta, abstractmethod
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, UpdateOne
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 from .renderers import Entry
 
-TEXT_DOC = {
-    'plaid2text': {
-        'tags': [],
-        'payee': '',
-        'posting_account': '',
-        'associated_account': '',
-        'date_downloaded': datetime.datetime.today(),
-        'date_last_pulled': datetime.datetime.today(),
-        'pulled_to_file':  False
+# SQLiteStorage stores every transaction as JSON text; orjson is a much
+# faster encoder/decoder when it is installed
+if orjson is not None:
+    def _dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+    _loads = orjson.loads
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
+def _text_doc():
+    """
+    Default plaid2text metadata for newly downloaded transactions, stamped
+    with the current time (not the time the module was imported)
+    """
+    now = datetime.datetime.today()
+    return {
+        'plaid2text': {
+            'tags': [],
+            'payee': '',
+            'posting_account': '',
+            'associated_account': '',
+            'date_downloaded': now,
+            'date_last_pulled': now,
+            'pulled_to_file':  False
+        }
     }
-}
+
+
+# Upserts per bulk_write() round-trip
+SAVE_BATCH_SIZE = 1000
+
 
 class StorageManager(metaclass=ABCMeta):
     @abstractmethod
@@ -40,7 +65,19 @@ class StorageManager(metaclass=ABCMeta):
         pass
 
     @abstractmethod
-    def update_transaction(self, update):
+    def update_transaction(self, update, mark_pulled=None, now=None):
+        """
+        Store the plaid2text metadata for one transaction. now is the
+        date_last_pulled timestamp, so a batch can share one; it defaults
+        to the current time.
+        """
+        pass
+
+    @abstractmethod
+    def update_transactions_bulk(self, updates, mark_pulled=None):
+        """
+        Apply several update_transaction() updates in one round-trip.
+        """
         pass
 
 class MongoDBStorage(StorageManager):
@@ -54,16 +91,24 @@ class MongoDBStorage(StorageManager):
         self.account = self.db[account]
 
     def save_transactions(self, transactions):
+        # One default document for the whole download
+        text_doc = _text_doc()
+        ops = []
         for t in transactions:
             id = t['transaction_id']
-            # t.update(TEXT_DOC)
+            # t.update(text_doc)
             # Convert datetime
             y, m, d = [int(i) for i in t['date'].split('-')]
             t['date'] = datetime.datetime(y, m, d)
             doc = {'$set': t}
             # Add default plaid2text to new inserts
-            doc['$setOnInsert'] = TEXT_DOC
-            self.account.update_many({'_id': id}, doc, True)
+            doc['$setOnInsert'] = text_doc
+            ops.append(UpdateOne({'_id': id}, doc, upsert=True))
+            if len(ops) == SAVE_BATCH_SIZE:
+                self.account.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            self.account.bulk_write(ops, ordered=False)
 
     def get_transactions(self, from_date=None, to_date=None, only_new=True):
         query = {}
@@ -77,35 +122,79 @@ class MongoDBStorage(StorageManager):
         elif not from_date and to_date:
             query['date'] = {'$lte': to_date}
 
-        transactions = self.account.find(query).sort('date', ASCENDING)
-        return list(transactions)
+        # Hand the cursor to the renderer rather than materializing every
+        # document up front. Entries are processed interactively, so the
+        # server must not time the cursor out between batches, which are
+        # sized so most downloads arrive in a few getMore round-trips.
+        return self.account.find(
+            query, no_cursor_timeout=True, batch_size=500
+        ).sort('date', ASCENDING)
 
-    def update_transaction(self, update, mark_pulled=None):
+    def update_transaction(self, update, mark_pulled=None, now=None):
         id = update.pop('transaction_id')
 
         if mark_pulled:
             update['pulled_to_file'  ] = mark_pulled            
-        update['date_last_pulled'] = datetime.datetime.today()
+        update['date_last_pulled'] = now if now is not None else datetime.datetime.today()
 
         self.account.update(
             {'_id': id},
             {'$set': {"plaid2text": update}}
         )
 
+    def update_transactions_bulk(self, updates, mark_pulled=None):
+        if not updates:
+            return
+        now = datetime.datetime.today()
+        ops = []
+        for update in updates:
+            id = update.pop('transaction_id')
+            if mark_pulled:
+                update['pulled_to_file'] = mark_pulled
+            update['date_last_pulled'] = now
+            ops.append(UpdateOne({'_id': id}, {'$set': {"plaid2text": update}}))
+        self.account.bulk_write(ops, ordered=False)
+
 
 class SQLiteStorage():
-    def __init__(self, dbpath, account, posting_account):
+    def __init__(self, dbpath, account, posting_account, account_id=None):
+        # All accounts share one table, so reads are limited to the rows of
+        # this Plaid account_id when it is known
+        self.account_id = account_id
         self.conn = sqlite3.connect(dbpath) 
+        # WAL only needs to sync on checkpoints, and NORMAL is still safe
+        # from corruption in that mode
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
 
         c = self.conn.cursor()
         c.execute("""
             create table if not exists transactions
-                (account_id, transaction_id, created, updated, plaid_json, metadata)
+                (account_id, transaction_id, created, updated, plaid_json, metadata, date)
             """)
         c.execute("""
             create unique index if not exists transactions_idx
                 ON transactions(account_id, transaction_id)
             """)
+        columns = [row[1] for row in c.execute("pragma table_info(transactions)")]
+        if 'date' not in columns:
+            # Databases created before the date column was split out of
+            # plaid_json: add it, and backfill it below
+            c.execute("alter table transactions add column date")
+        c.execute("""
+            update transactions set date = json_extract(plaid_json, '$.date')
+                where date is null
+            """)
+        # Indexes matching the get_transactions() filters, so they become
+        # index seeks instead of parsing the JSON of every row
+        c.execute("""
+            create index if not exists transactions_date_idx
+                ON transactions(date)
+            """)
+        c.execute("""
+            create index if not exists transactions_pulled_idx
+                ON transactions(coalesce(json_extract(metadata, '$.pulled_to_file'), 0))
+            """)
         self.conn.commit()
 
         # This might be needed if there's not consistent support for json_extract in sqlite3 installations
@@ -121,54 +210,67 @@ class SQLiteStorage():
 
         Occurs when using the --download-transactions option.
         """
+        rows = []
         for t in transactions:
             trans_id = t['transaction_id']
             act_id   = t['account_id'] 
 
             metadata = t.get('plaid2text', None)
             if metadata is not None:
-                metadata = json.dumps(metadata)
+                metadata = _dumps(metadata)
 
-            c = self.conn.cursor()
-            c.execute("""
+            rows.append([act_id, trans_id, t['date'], _dumps(t), metadata])
+
+        # One transaction for the whole batch, so one fsync instead of one
+        # per transaction
+        with self.conn:
+            self.conn.executemany("""
                 insert into 
-                    transactions(account_id, transaction_id, created, updated, plaid_json, metadata)
-                    values(?,?,strftime('%Y-%m-%dT%H:%M:%SZ', 'now'),strftime('%Y-%m-%dT%H:%M:%SZ', 'now'),?,?)
+                    transactions(account_id, transaction_id, created, updated, date, plaid_json, metadata)
+                    values(?,?,strftime('%Y-%m-%dT%H:%M:%SZ', 'now'),strftime('%Y-%m-%dT%H:%M:%SZ', 'now'),?,?,?)
                     on conflict(account_id, transaction_id) DO UPDATE
                         set updated = strftime('%Y-%m-%dT%H:%M:%SZ', 'now'),
+                            date       = excluded.date,
                             plaid_json = excluded.plaid_json,
                             metadata   = excluded.metadata
-                """, [act_id, trans_id, json.dumps(t), metadata])
-            self.conn.commit()
+                """, rows)
 
     def get_transactions(self, from_date=None, to_date=None, only_new=True):
         query = "select plaid_json, metadata from transactions";
 
         conditions = []
+        params  = []
+        if self.account_id:
+            conditions.append("account_id = ?")
+            params.append(self.account_id)
+
         if only_new: 
-            conditions.append("coalesce(json_extract(plaid_json, '$.pulled_to_file'), false) = false")
+            # pulled_to_file is written to metadata by update_transaction(),
+            # never to plaid_json
+            conditions.append("coalesce(json_extract(metadata, '$.pulled_to_file'), 0) = 0")
 
-        params  = []
         if from_date and to_date and (from_date <= to_date):
-            conditions.append("json_extract(plaid_json, '$.date') between ? and ?")
+            conditions.append("date between ? and ?")
             params += [from_date.strftime("%Y-%m-%d"), to_date.strftime("%Y-%m-%d")]
         elif from_date and not to_date:
-            conditions.append("json_extract(plaid_json, '$.date') >= ?")
-            params += [from_date]
+            conditions.append("date >= ?")
+            params += [from_date.strftime("%Y-%m-%d")]
         elif not from_date and to_date:
-            conditions.append("json_extract(plaid_json, '$.date') <= ?")
-            params += [to_date]
+            conditions.append("date <= ?")
+            params += [to_date.strftime("%Y-%m-%d")]
 
         if len(conditions) > 0:
             query = "%s where %s" % ( query, " AND ".join( conditions ) )
 
+        # Rows are fetched up front because processing updates this table
+        # on the same connection, but each row is only decoded as the
+        # renderer consumes it.
         transactions = self.conn.cursor().execute(query, params).fetchall()
 
-        ret = []
         for row in transactions:
-            t = json.loads(row[0])
+            t = _loads(row[0])
             if row[1]:
-                t['plaid2text'] = json.loads(row[1])
+                t['plaid2text'] = _loads(row[1])
             else:
                 t['plaid2text'] = {}
 
@@ -176,23 +278,40 @@ class SQLiteStorage():
                 # set empty objects ({}) to None to account for assumptions that None means not processed
                 t['plaid2text'] = None
 
-            t['date'] = date_parser.parse( t['date'] )        
-
-            ret.append(t)
+            # Plaid dates are always YYYY-MM-DD; no need for a general parser
+            y, m, d = [int(i) for i in t['date'][:10].split('-')]
+            t['date'] = datetime.datetime(y, m, d)
 
-        return ret
+            yield t
 
-    def update_transaction(self, update, mark_pulled=None):
+    def update_transaction(self, update, mark_pulled=None, now=None):
         trans_id = update.pop('transaction_id')
         if mark_pulled:
             update['pulled_to_file'  ] = mark_pulled            
-        update['date_last_pulled'] = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
-
-        update['archived'] = null
-
-        c = self.conn.cursor()
-        c.execute("""
-            update transactions set metadata = json_patch(coalesce(metadata, '{}'), ?) 
-            where transaction_id = ?
-        """, [json.dumps(update), trans_id] )
-        self.conn.commit()
+        if now is None:
+            now = datetime.datetime.now()
+        update['date_last_pulled'] = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+        with self.conn:
+            self.conn.execute("""
+                update transactions set metadata = json_patch(coalesce(metadata, '{}'), ?) 
+                where transaction_id = ?
+            """, [_dumps(update), trans_id] )
+
+    def update_transactions_bulk(self, updates, mark_pulled=None):
+        if not updates:
+            return
+        now = datetime.datetime.now().strftime("%Y-%m-%dT%H:%M:%SZ")
+        rows = []
+        for update in updates:
+            trans_id = update.pop('transaction_id')
+            if mark_pulled:
+                update['pulled_to_file'] = mark_pulled
+            update['date_last_pulled'] = now
+            rows.append([_dumps(update), trans_id])
+
+        with self.conn:
+            self.conn.executemany("""
+                update transactions set metadata = json_patch(coalesce(metadata, '{}'), ?)
+                where transaction_id = ?
+            """, rows)
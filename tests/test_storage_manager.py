@@ -0,0 +1,59 @@
+import datetime
+
+from plaid2text.storage_manager import SQLiteStorage
+
+
+def _transaction(transaction_id, date):
+    return {
+        'transaction_id': transaction_id,
+        'account_id': 'account',
+        'date': date,
+        'name': 'Coffee Shop',
+        'amount': 4.5,
+    }
+
+
+def _storage():
+    storage = SQLiteStorage(':memory:', 'account', 'Assets:Bank:Checking')
+    storage.save_transactions([
+        _transaction('first', '2020-01-01'),
+        _transaction('second', '2020-01-02'),
+    ])
+    return storage
+
+
+def test_update_transaction_marks_pulled():
+    storage = _storage()
+
+    # update_transaction used to raise NameError on an undefined ``null``
+    storage.update_transaction({'transaction_id': 'first', 'payee': 'Coffee'}, mark_pulled=True)
+
+    new = list(storage.get_transactions(only_new=True))
+    assert [t['transaction_id'] for t in new] == ['second']
+    assert new[0]['date'] == datetime.datetime(2020, 1, 2)
+    assert new[0]['plaid2text'] is None
+
+    stored = dict((t['transaction_id'], t) for t in storage.get_transactions(only_new=False))
+    assert stored['first']['plaid2text']['pulled_to_file'] is True
+    assert stored['first']['plaid2text']['payee'] == 'Coffee'
+
+
+def test_get_transactions_filters_on_date():
+    storage = _storage()
+
+    def ids(**kwargs):
+        return sorted(t['transaction_id'] for t in storage.get_transactions(**kwargs))
+
+    assert ids(from_date=datetime.datetime(2020, 1, 2)) == ['second']
+    assert ids(to_date=datetime.datetime(2020, 1, 1)) == ['first']
+    assert ids(from_date=datetime.datetime(2020, 1, 1),
+               to_date=datetime.datetime(2020, 1, 2)) == ['first', 'second']
+
+
+def test_get_transactions_only_returns_own_account():
+    shared = SQLiteStorage(':memory:', 'checking', 'Assets:Bank:Checking', account_id='account')
+    other = _transaction('other', '2020-01-03')
+    other['account_id'] = 'other-account'
+    shared.save_transactions([_transaction('mine', '2020-01-01'), other])
+
+    assert [t['transaction_id'] for t in shared.get_transactions()] == ['mine']